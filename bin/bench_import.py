@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8; -*-
+
+"""
+Cold-start guard: measures how long `from insales import InSalesApi`
+takes in a fresh interpreter and checks that parsers, composers and
+transports are not loaded by it. Exits with a non-zero status if the
+import is slower than the budget or pulls in a heavy module.
+
+    $ bin/bench_import.py [--budget-ms 30] [--runs 10]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STATEMENT = "from insales import InSalesApi"
+
+# modules that must only be loaded when actually used
+HEAVY_MODULES = [
+    'insales.parsing',
+    'insales.composing',
+    'xml.parsers.expat',
+    'xml.sax',
+    'xml.etree.ElementTree',
+    'iso8601',
+    'decimal',
+    'http.client',
+    'socket',
+    'base64',
+    'json',
+    'concurrent.futures',
+    'sqlite3',
+]
+
+
+def run(code, *flags):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run(
+        [sys.executable] + list(flags) + ['-c', code],
+        env=env, check=True, capture_output=True, text=True,
+    )
+
+
+def import_time_us():
+    "Cumulative import time of top-level `insales` imports, in microseconds"
+    stderr = run(STATEMENT, '-X', 'importtime').stderr
+    total = 0
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        # nested imports are indented by two more spaces
+        name = parts[2][1:]
+        if name.startswith('insales'):
+            total += int(parts[1])
+    return total
+
+
+def loaded_heavy_modules():
+    code = "import sys; %s; print(' '.join(m for m in %r if m in sys.modules))" % (
+        STATEMENT, HEAVY_MODULES)
+    return run(code).stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=30.0)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    run(STATEMENT)  # warm up the bytecode cache
+    times = sorted(import_time_us() / 1000.0 for _ in range(args.runs))
+    median = statistics.median(times)
+    print("%s: median %.1f ms, best %.1f ms over %d runs (budget %.1f ms)" % (
+        STATEMENT, median, times[0], args.runs, args.budget_ms))
+
+    failed = False
+    heavy = loaded_heavy_modules()
+    if heavy:
+        print("eagerly loaded: %s" % ', '.join(heavy))
+        failed = True
+    if median > args.budget_ms:
+        print("import is over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8; -*-
 
-import urllib.request, re, pprint
+import urllib.request, re, pprint, json, os, sys
 from itertools import tee
 
 
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'insales', 'schema.json')
+
+
 def parse(lines):
     re_opening = re.compile(".*&lt;([\\w\\d_\\-]+).*")
     first, second = tee(lines)
@@ -43,6 +46,16 @@ def main():
     with urllib.request.urlopen("https://api.insales.ru/") as f:
         lines = map(lambda x: x.decode("utf-8"), f.readlines())
         arrs = parse(lines)
+
+    if '--write' in sys.argv[1:]:
+        # refresh array map of the bundled schema, resources are kept as is
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            schema = json.load(f)
+        schema['arrays'] = dict(sorted(arrs.items()))
+        with open(SCHEMA_PATH, 'w', encoding='utf-8') as f:
+            json.dump(schema, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+    else:
         pprint.PrettyPrinter(indent=8, width=80).pprint(arrs)
 
 
@@ -1,4 +1,36 @@
 # -*- coding: utf-8; -*-
 
-from insales.api import *
-from insales.connection import ApiError
+# Submodules are imported on first attribute access, so that
+# `import insales` doesn't pull in parsers and transports
+# until they are needed (PEP 562)
+
+_lazy = {
+    'InSalesApi': 'insales.api',
+    'ApiError': 'insales.connection',
+    'Connection': 'insales.connection',
+    'parse': 'insales.parsing',
+    'compose': 'insales.composing',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name):
+    from importlib import import_module
+    module = _lazy.get(name)
+    if module is None:
+        # submodules as well, `import insales` used to load the api
+        # with its connection, parser and composer, and code relies on
+        # e.g. `insales.connection.ApiError`
+        from importlib.util import find_spec
+        if name.startswith('_') or find_spec('insales.' + name) is None:
+            raise AttributeError(
+                "module 'insales' has no attribute %r" % name)
+        return import_module('insales.' + name)
+    value = getattr(import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,119 +1,72 @@
 # -*- coding: utf-8; -*-
 
 import datetime
-from insales.parsing import parse
-from insales.composing import compose
-from insales.connection import Connection
+import os
+import time
+from insales.connection import Connection, ApiError
+from insales.coalescing import SingleFlight, request_key, resource_of, affects
+from insales.batch import map_calls, chunked, ObjectsById
+from insales import schema
 
 
 class InSalesApi(object):
 
-    arrays = {
-        'all-tags': 'all-tag',
-        'application-actions': 'application-action',
-        'application-charges': 'application-charge',
-        'application-widgets': 'application-widget',
-        'articles': 'article',
-        'blogs': 'blog',
-        'bonus-system-transactions': 'bonus-system-transaction',
-        'categories': 'category',
-        'characteristics': 'characteristic',
-        'client-groups': 'client-group',
-        'clients': 'client',
-        'collection-field-values': 'collection-field-value',
-        'collection-fields': 'collection-field',
-        'collection-filters': 'collection-filter',
-        'collection-ids': 'collection-id',
-        'collections': 'collection',
-        'collections-ids': 'collections-id',
-        'collects': 'collect',
-        'custom-statuses': 'custom-status',
-        'delivery-locations': 'delivery-location',
-        'delivery-locations-attributes': 'delivery-locations-attribute',
-        'delivery-zones': 'delivery-zone',
-        'delivery-zones-attributes': 'delivery-zones-attribute',
-        'description-translations': 'description-translation',
-        'discount-codes': 'discount-code',
-        'discount-collections': 'discount-collection',
-        'discount-order-lines-ids': 'discount-order-lines-id',
-        'discount-products-ids': 'discount-products-id',
-        'discounts': 'discount',
-        'discounts-attributes': 'discounts-attribute',
-        'domains': 'domain',
-        'errors': 'error',
-        'field-options': 'field-option',
-        'field-options-attributes': 'field-options-attribute',
-        'field-values-attributes': 'field-values-attribute',
-        'fields': 'field',
-        'fields-values': 'fields-value',
-        'fields-values-attributes': 'fields-values-attribute',
-        'files': 'file',
-        'images': 'image',
-        'js-tags': 'js-tag',
-        'locations': 'location',
-        'locations-attributes': 'locations-attribute',
-        'menu-items': 'menu-item',
-        'menus': 'menu',
-        'nil-classes': 'nil-class',
-        'option-names': 'option-name',
-        'option-values': 'option-value',
-        'options': 'option',
-        'options-attributes': 'options-attribute',
-        'order-changes': 'order-change',
-        'order-lines': 'order-line',
-        'order-lines-attributes': 'order-lines-attribute',
-        'orders': 'order',
-        'outlets': 'outlet',
-        'pages': 'page',
-        'payment-delivery-variants': 'payment-delivery-variant',
-        'payment-delivery-variants-attributes': 'payment-delivery-variants-attribute',
-        'pick-up-sources': 'pick-up-source',
-        'price-kinds': 'price-kind',
-        'prices': 'price',
-        'prices-in-site-currency': 'price-in-site-currency',
-        'product-bundle-components': 'product-bundle-component',
-        'product-bundle-components-attributes': 'product-bundle-components-attribute',
-        'product-field-values': 'product-field-value',
-        'product-field-values-attributes': 'product-field-values-attribute',
-        'products': 'product',
-        'properties': 'property',
-        'properties-attributes': 'properties-attribute',
-        'redirects': 'redirect',
-        'related-products': 'related-product',
-        'reviews': 'review',
-        'rules': 'rule',
-        'rules-attributes': 'rules-attribute',
-        'similar-ids': 'similar-id',
-        'stock-currencies': 'stock-currency',
-        'supplementary-ids': 'supplementary-id',
-        'tags': 'tag',
-        'tariffs': 'tariff',
-        'tariffs-attributes': 'tariffs-attribute',
-        'title-translations': 'title-translation',
-        'variant-field-values': 'variant-field-value',
-        'variant-field-values-attributes': 'variant-field-values-attribute',
-        'variants': 'variant',
-        'variants-attributes': 'variants-attribute',
-        'warnings': 'warning',
-        'webhooks': 'webhook'
-    }
+    # Array name to element name mapping used when composing requests,
+    # see insales/schema.json
+    arrays = schema.LazyArrays()
 
     @classmethod
     def from_credentials(cls, account, api_key, password, **kwargs):
         return cls(Connection(account, api_key, password, **kwargs))
 
-    def __init__(self, connection):
+    # Largest `per_page` of list endpoints fetched by ids, see `_get_by_ids`
+    max_per_page = {
+        '/admin/orders.xml': 100,
+        '/admin/products.xml': 250,
+    }
+
+    # Parser, composer and transport modules are imported on first use,
+    # so that `import insales` stays cheap for short-lived processes
+
+    def __init__(self, connection, cache_window=0, tracker=None):
         self.connection = connection
+        # Concurrent identical GETs share one request. With a non-zero
+        # `cache_window` (seconds) results are also reused for a while.
+        # Any write drops shared results for the whole resource it touches,
+        # e.g. updating a variant drops cached products and their variants
+        self._flights = SingleFlight(window=cache_window)
+        # `insales.diffing.ChangeTracker` to send only changed fields
+        self.tracker = tracker
+
+    def __getattr__(self, name):
+        # Methods for resources without a hand-written implementation are
+        # generated from the API schema on first access
+        if name.startswith('_'):
+            raise AttributeError(name)
+        method = schema.make_method(name)
+        if method is None:
+            raise AttributeError("%r object has no attribute %r" %
+                                 (type(self).__name__, name))
+        setattr(InSalesApi, name, method)
+        return getattr(self, name)
 
     def iterate_over_all(
-        self, method, updated_since=datetime.datetime.fromtimestamp(0), **kwargs
+        self, method, updated_since=datetime.datetime.fromtimestamp(0),
+        pager=None, **kwargs
     ):
-        "Iterate over any method with pagination"
+        """
+        Iterate over any method with pagination. With an
+        `insales.pagination.AdaptivePager` the page size and pauses between
+        pages are tuned on the go.
+        """
         mykwargs = dict(kwargs)
         mykwargs.update({"page": 1, "updated_since": updated_since, "from_id": None})
 
         while True:
-            objects = method(**mykwargs)
+            if pager is None:
+                objects = method(**mykwargs)
+            else:
+                objects = self._fetch_adaptive(method, pager, mykwargs)
             if not objects:
                 return
             for obj in objects:
@@ -121,6 +74,48 @@ class InSalesApi(object):
                 mykwargs["updated_since"] = obj.get("updated-at")
                 yield obj
 
+    def _fetch_adaptive(self, method, pager, kwargs):
+        import socket
+
+        # with `throttle` on the connection scheduler already paces
+        # requests by the same usage header
+        if pager.delay and not getattr(self.connection, 'throttle', False):
+            time.sleep(pager.delay)
+        while True:
+            kwargs["per_page"] = pager.per_page
+            started = time.monotonic()
+            try:
+                objects = method(**kwargs)
+            except (ApiError, socket.timeout) as e:
+                # a 5xx or a timeout most likely means the page is too
+                # heavy to render in time
+                if getattr(e, 'code', None) and e.code < 500:
+                    raise
+                if not pager.failed():
+                    raise
+                continue
+            scheduler = getattr(self.connection, 'scheduler', None)
+            pager.observe(len(objects), time.monotonic() - started,
+                          scheduler and scheduler.usage)
+            return objects
+
+    def map(self, method, iterable, workers=8, ordered=True, progress=None):
+        """
+        Call `method` (a bound method or its name) for each element of
+        `iterable` concurrently. Calls start right away; the returned
+        iterator yields `insales.batch.BatchItem`s, see
+        `insales.batch.map_calls`. All workers share this api's
+        connection and therefore its throttling state.
+
+        >>> for item in api.map('delete_collect', collect_ids):
+        ...     if not item.ok:
+        ...         print(item.args, item.error)
+        """
+        if isinstance(method, str):
+            method = getattr(self, method)
+        return map_calls(method, iterable, workers=workers, ordered=ordered,
+                         progress=progress)
+
     #========================================================================
     # Заказы
     #========================================================================
@@ -149,6 +144,10 @@ class InSalesApi(object):
             qargs["payment_gateway_id"] = fulfillment_status
         return self._get("/admin/orders.xml", qargs) or []
 
+    def get_orders_by_ids(self, order_ids, workers=4):
+        "Fetch many orders in few list requests, see `_get_by_ids`"
+        return self._get_by_ids("/admin/orders.xml", order_ids, workers)
+
     def get_order(self, order_id):
         return self._get('/admin/orders/%s.xml' % order_id)
 
@@ -290,6 +289,10 @@ class InSalesApi(object):
             qargs["with_deleted"] = with_deleted
         return self._get("/admin/products.xml", qargs) or []
 
+    def get_products_by_ids(self, product_ids, workers=4):
+        "Fetch many products in few list requests, see `_get_by_ids`"
+        return self._get_by_ids("/admin/products.xml", product_ids, workers)
+
     def get_product(self, product_id):
         return self._get('/admin/products/%s.xml' % product_id)
 
@@ -343,6 +346,24 @@ class InSalesApi(object):
         return self._add('/admin/products/%s/images.xml' % product_id,
                          image_data, root='image')
 
+    def upload_product_image(self, product_id, file, image_data={}):
+        """
+        Add an image from a file path or a binary file object. The file is
+        streamed into the request body, so it's never loaded into memory
+        as a whole. Run several uploads concurrently with `map`:
+
+        >>> for item in api.map('upload_product_image',
+        ...                     [(1, 'a.jpg'), (2, 'b.jpg')]):
+        ...     if not item.ok:
+        ...         print(item.args, item.error)
+        """
+        if isinstance(file, str) and 'filename' not in image_data:
+            image_data = dict(image_data, filename=os.path.basename(file))
+        from insales.composing import AttachmentBody
+        body = AttachmentBody(file, image_data, root='image', arrays=self.arrays,
+                              types=schema.field_types())
+        return self._req('post', '/admin/products/%s/images.xml' % product_id, body)
+
     def update_product_image(self, product_id, image_id, image_data):
         return self._update('/admin/products/%s/images/%s.xml' % (product_id, image_id),
                             image_data, root='image')
@@ -491,21 +512,77 @@ class InSalesApi(object):
 
     #========================================================================
     def _get(self, endpoint, qargs={}):
-        return self._req('get', endpoint, qargs)
+        key = request_key('get', endpoint, qargs)
+        return self._flights.do(key, lambda: self._req('get', endpoint, qargs))
+
+    def _get_by_ids(self, endpoint, ids, workers):
+        """
+        Fetch objects with the given ids from a list endpoint, splitting
+        them into chunks of the endpoint's `max_per_page` fetched
+        concurrently. Returns `ObjectsById`; ids the server didn't return
+        are in its `missing` set. The first failed request is re-raised.
+        """
+        ids = sorted(set(int(x) for x in ids))
+        per_page = self.max_per_page[endpoint]
+        chunks = [(endpoint, chunk, per_page)
+                  for chunk in chunked(ids, per_page)]
+        found = ObjectsById()
+        for item in self.map(self._get_chunk_by_ids, chunks, workers=workers):
+            if not item.ok:
+                raise item.error
+            for obj in item.result:
+                found[obj['id']] = obj
+        found.missing.update(x for x in ids if x not in found)
+        return found
+
+    def _get_chunk_by_ids(self, endpoint, ids, per_page):
+        objects = []
+        while ids:
+            page = self._get(endpoint, {"ids": ids, "per_page": per_page}) or []
+            objects.extend(page)
+            if len(page) < per_page:
+                break
+            # a full page may have been cut short, ask for the rest
+            returned = set(obj['id'] for obj in page)
+            rest = [x for x in ids if x not in returned]
+            if len(rest) == len(ids):
+                break
+            ids = rest
+        return objects
 
     def _add(self, endpoint, data, root):
-        xml = compose(data, root=root, arrays=self.arrays)
-        return self._req('post', endpoint, xml)
+        return self._req('post', endpoint, self._compose(data, root))
 
     _post = _add
 
     def _update(self, endpoint, data, root):
-        xml = compose(data, root=root, arrays=self.arrays)
-        return self._req('put', endpoint, xml)
+        if self.tracker is not None:
+            return self.tracker.update(self, endpoint, data, root)
+        return self._put(endpoint, data, root)
+
+    def _put(self, endpoint, data, root):
+        return self._req('put', endpoint, self._compose(data, root))
 
     def _delete(self, endpoint):
+        if self.tracker is not None:
+            self.tracker.forget(endpoint)
         return self._req('delete', endpoint)
 
-    def _req(self, method, *args, **kwargs):
-        response = getattr(self.connection, method)(*args, **kwargs)
-        return parse(response)
+    def _compose(self, data, root):
+        from insales.composing import compose
+        return compose(data, root=root, arrays=self.arrays,
+                       types=schema.field_types())
+
+    @staticmethod
+    def _parse(response):
+        "Turns raw response bytes into the returned value"
+        from insales.parsing import parse
+        return parse(response, types=schema.field_types())
+
+    def _req(self, method, endpoint, *args, **kwargs):
+        try:
+            response = getattr(self.connection, method)(endpoint, *args, **kwargs)
+        finally:
+            if method != 'get':
+                self._flights.invalidate(affects(resource_of(endpoint)))
+        return self._parse(response)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8; -*-
+
+import contextvars
+import threading
+
+
+class BatchItem(object):
+    "Outcome of a single call in a batch"
+    __slots__ = ('index', 'args', 'result', 'error')
+
+    def __init__(self, index, args, result=None, error=None):
+        self.index = index
+        self.args = args
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<BatchItem #%d ok>" % self.index
+        return "<BatchItem #%d error=%r>" % (self.index, self.error)
+
+
+def call_with(fn, args):
+    if isinstance(args, tuple):
+        return fn(*args)
+    if isinstance(args, dict):
+        return fn(**args)
+    return fn(args)
+
+
+def map_calls(fn, iterable, workers=8, ordered=True, progress=None):
+    """
+    Run `fn` for every element of `iterable` on a pool of `workers`
+    threads and return an iterator of `BatchItem`s, one per element.
+    Tuples are passed as positional arguments, dicts as keyword
+    arguments, anything else as a single argument.
+
+    All calls are submitted right away, whether or not the results are
+    consumed. Abandoning the iterator early cancels calls that haven't
+    started yet.
+
+    A failed call doesn't abort the batch: its exception is kept in
+    `BatchItem.error`. Items are yielded in input order unless
+    `ordered` is false, in which case they come as they complete.
+    `progress(done, total)` is called from worker threads after each
+    call.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    items = list(iterable)
+    total = len(items)
+    done = [0]
+    done_lock = threading.Lock()
+
+    def run(index, args):
+        try:
+            item = BatchItem(index, args, result=call_with(fn, args))
+        except Exception as e:
+            item = BatchItem(index, args, error=e)
+        if progress is not None:
+            with done_lock:
+                done[0] += 1
+                count = done[0]
+            progress(count, total)
+        return item
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    # each call runs in a copy of the caller's context, so that e.g.
+    # `insales.throttling.priority` applies to it
+    futures = [pool.submit(contextvars.copy_context().run, run, i, args)
+               for i, args in enumerate(items)]
+    # workers exit once the submitted calls are done
+    pool.shutdown(wait=False)
+
+    def results():
+        try:
+            for future in (futures if ordered else as_completed(futures)):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return results()
+
+
+class ObjectsById(dict):
+    "Objects keyed by id; ids that weren't found are listed in `missing`"
+
+    def __init__(self, *args, **kwargs):
+        super(ObjectsById, self).__init__(*args, **kwargs)
+        self.missing = set()
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8; -*-
+
+import threading
+import time
+
+from copy import deepcopy
+
+
+class _Call(object):
+    __slots__ = ('event', 'result', 'error', 'waiters', 'done_at')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.done_at = None
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into a single call
+    of the underlying function. Callers that join an in-flight call
+    block until it completes and get their own deep copy of its
+    result, so parsed structures are never shared between threads.
+
+    With `window` > 0 a completed result is also served to calls
+    arriving within `window` seconds after it, unless `invalidate`
+    drops it earlier.
+    """
+
+    def __init__(self, window=0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        try:
+            hash(key)
+        except TypeError:
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and self._is_fresh(call):
+                call.waiters += 1
+                leader = False
+            else:
+                if self.window:
+                    self._purge()
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return deepcopy(call.result)
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.done_at = time.monotonic()
+            with self._lock:
+                if not self.window or call.error is not None:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                shared = self.window or call.waiters
+            call.event.set()
+
+        return deepcopy(call.result) if shared else call.result
+
+    def invalidate(self, match=None):
+        """
+        Forget completed and in-flight calls whose keys satisfy `match`,
+        all of them by default, so that later calls start afresh. Callers
+        already waiting for an in-flight call still get its result.
+        """
+        with self._lock:
+            stale = [key for key in self._calls
+                     if match is None or match(key)]
+            for key in stale:
+                del self._calls[key]
+
+    def _is_fresh(self, call):
+        if call.done_at is None:
+            return True
+        return time.monotonic() - call.done_at < self.window
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [key for key, call in self._calls.items()
+                   if call.done_at is not None
+                   and now - call.done_at >= self.window]
+        for key in expired:
+            del self._calls[key]
+
+
+def request_key(method, endpoint, qargs):
+    args = []
+    for key, value in qargs.items():
+        if isinstance(value, list):
+            value = tuple(value)
+        args.append((key, value))
+    return (method, endpoint, tuple(sorted(args)))
+
+
+def resource_of(endpoint):
+    """
+    Top-level resource path an endpoint belongs to, e.g.
+    `/admin/products` for `/admin/products/1/variants/2.xml`
+    """
+    path = endpoint.split('?', 1)[0]
+    if path.endswith('.xml'):
+        path = path[:-4]
+    return '/'.join(path.split('/')[:3])
+
+
+def affects(resource):
+    "Key predicate for `SingleFlight.invalidate` matching a resource"
+    def match(key):
+        return resource_of(key[1]) == resource
+    return match
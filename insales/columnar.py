@@ -0,0 +1,532 @@
+# -*- coding: utf-8; -*-
+
+import datetime
+
+from array import array
+from decimal import Context, Decimal, Inexact, InvalidOperation
+from functools import partial
+
+import iso8601
+
+from insales import schema
+from insales.parsing import (
+    HTML_FIELDS, BooleanHandler, DateHandler, DateTimeHandler,
+    DecimalHandler, IntegerHandler, NoTypeHandler, TimestampHandler,
+    XmlProcessor, decode_date, decode_decimal, decode_timestamp, parse,
+)
+
+
+UTC = datetime.timezone.utc
+
+
+class Column(object):
+    """
+    Values of a single field across a batch of objects. Missing
+    values (absent or nil) are tracked in a separate validity mask
+    """
+    __slots__ = ('values', 'mask')
+
+    typecode = None
+
+    def __init__(self):
+        self.values = array(self.typecode)
+        self.mask = array('b')
+
+    def __len__(self):
+        return len(self.mask)
+
+    @classmethod
+    def accepts(cls, value):
+        raise NotImplementedError()
+
+    def append(self, value):
+        # raises ArithmeticError or ValueError, leaving the column
+        # intact, if `value` can't be stored in it
+        if value is None:
+            self.values.append(self.null)
+            self.mask.append(0)
+        else:
+            self.values.append(self.encode(value))
+            self.mask.append(1)
+
+    def pad(self, count):
+        for _ in range(count):
+            self.append(None)
+
+    def to_list(self):
+        return [self.decode(v) if m else None
+                for v, m in zip(self.values, self.mask)]
+
+    def to_numpy(self):
+        numpy = _import_numpy()
+        data = numpy.frombuffer(self.values, dtype=self.dtype).copy()
+        if all(self.mask):
+            return data
+        mask = numpy.frombuffer(self.mask, dtype=numpy.int8) == 0
+        return numpy.ma.masked_array(data, mask=mask)
+
+
+class IntegerColumn(Column):
+    __slots__ = ()
+
+    typecode = 'q'
+    dtype = 'int64'
+    null = 0
+
+    @classmethod
+    def accepts(cls, value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+
+class BooleanColumn(Column):
+    __slots__ = ()
+
+    typecode = 'b'
+    dtype = 'int8'
+    null = 0
+
+    @classmethod
+    def accepts(cls, value):
+        return isinstance(value, bool)
+
+    def encode(self, value):
+        return int(value)
+
+    def decode(self, value):
+        return bool(value)
+
+    def to_numpy(self):
+        return super(BooleanColumn, self).to_numpy().astype(bool)
+
+
+class DecimalColumn(Column):
+    """
+    Decimals are kept as fixed-point 64-bit integers: the stored
+    value is `Decimal * 10**scale`. Sums over such a column are exact;
+    a value with more than `scale` decimals or out of int64 range is
+    never rounded, `ColumnBatch` turns the column into an
+    `ObjectColumn` instead
+    """
+    __slots__ = ('scale', '_quantum')
+
+    typecode = 'q'
+    dtype = 'int64'
+    null = 0
+
+    _exact = Context(traps=[Inexact, InvalidOperation])
+
+    def __init__(self, scale=4):
+        super(DecimalColumn, self).__init__()
+        self.scale = scale
+        self._quantum = Decimal(1).scaleb(-scale)
+
+    @classmethod
+    def accepts(cls, value):
+        return isinstance(value, Decimal)
+
+    def encode(self, value):
+        quantized = value.quantize(self._quantum, context=self._exact)
+        return int(quantized.scaleb(self.scale))
+
+    def decode(self, value):
+        return Decimal(value).scaleb(-self.scale)
+
+
+class TimestampColumn(Column):
+    "Datetimes as float seconds since epoch, naive values taken as UTC"
+    __slots__ = ()
+
+    typecode = 'd'
+    dtype = 'float64'
+    null = 0.0
+
+    @classmethod
+    def accepts(cls, value):
+        return isinstance(value, datetime.datetime)
+
+    def encode(self, value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=UTC)
+        return value.timestamp()
+
+    def decode(self, value):
+        return datetime.datetime.fromtimestamp(value, UTC)
+
+
+class ObjectColumn(Column):
+    "Fallback for strings, lists and values of mixed types"
+    __slots__ = ()
+
+    def __init__(self):
+        self.values = []
+        self.mask = array('b')
+
+    null = None
+
+    @classmethod
+    def accepts(cls, value):
+        return True
+
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+    def to_numpy(self):
+        numpy = _import_numpy()
+        data = numpy.empty(len(self.values), dtype=object)
+        data[:] = self.values
+        return data
+
+
+typed_columns = [
+    BooleanColumn,
+    IntegerColumn,
+    DecimalColumn,
+    TimestampColumn,
+]
+
+
+class ColumnBatch(object):
+    """
+    Columnar view over a list of parsed objects, e.g. pages returned
+    by `InSalesApi.get_orders`. Nested dicts are flattened into
+    dotted field names (`client.id`), arrays are kept as is in
+    object columns.
+
+    Raw list responses are best added with `extend_xml`: columns are
+    filled right from the parser events, no dicts are built.
+
+    >>> batch = ColumnBatch()
+    >>> for body in pages:
+    ...     batch.extend_xml(body)
+    >>> totals = batch['total-price'].to_numpy()
+    """
+
+    def __init__(self, fields=None, decimal_scale=4):
+        self.fields = fields and set(fields)
+        self.decimal_scale = decimal_scale
+        self.columns = {}
+        self._length = 0
+
+    @classmethod
+    def from_objects(cls, objects, **kwargs):
+        batch = cls(**kwargs)
+        batch.extend(objects)
+        return batch
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    def extend(self, objects):
+        for obj in objects:
+            self.append(obj)
+
+    def extend_xml(self, xml_string):
+        "Add objects of a raw list response, e.g. `<orders type=\"array\">`"
+        parse(xml_string, processor=partial(ColumnProcessor, self),
+              types=schema.field_types())
+
+    def append(self, obj):
+        for name, value in self._flatten(obj):
+            self._put(name, value)
+        self._end_row()
+
+    def _put(self, name, value):
+        "Set field `name` of the row being built"
+        if self.fields is not None and name not in self.fields:
+            return
+        row = self._length
+        column = self.columns.get(name)
+        if column is None:
+            if value is None:
+                return
+            column = self._new_column(value)
+            column.pad(row)
+            self.columns[name] = column
+        elif len(column.mask) != row:
+            # repeated field, the first value wins
+            return
+        elif value is not None and not column.accepts(value):
+            column = self._widen(name, column)
+        try:
+            column.append(value)
+        except (ArithmeticError, ValueError):
+            # doesn't fit, e.g. a decimal with too many digits
+            self._widen(name, column).append(value)
+
+    def _end_row(self):
+        row = self._length
+        self._length = row + 1
+        for column in self.columns.values():
+            if len(column.mask) == row:
+                column.append(None)
+
+    def to_dicts(self):
+        lists = dict((name, c.to_list()) for name, c in self.columns.items())
+        return [dict((name, values[i]) for name, values in lists.items())
+                for i in range(self._length)]
+
+    def to_numpy(self):
+        return dict((name, c.to_numpy()) for name, c in self.columns.items())
+
+    def _flatten(self, obj, prefix=''):
+        for key, value in obj.items():
+            name = prefix + key
+            if isinstance(value, dict):
+                yield from self._flatten(value, name + '.')
+            else:
+                yield name, value
+
+    def _new_column(self, value):
+        for column_type in typed_columns:
+            if column_type.accepts(value):
+                if column_type is DecimalColumn:
+                    return DecimalColumn(self.decimal_scale)
+                return column_type()
+        return ObjectColumn()
+
+    def _widen(self, name, column):
+        widened = ObjectColumn()
+        for value in column.to_list():
+            widened.append(value)
+        self.columns[name] = widened
+        return widened
+
+
+def _nil(string):
+    return None
+
+
+def _boolean(string):
+    return string == 'true'
+
+
+# type attribute to decoder and the value of an empty element, the
+# same as with `insales.parsing.handler_for`
+_typed = {
+    'integer': (int, IntegerHandler.default),
+    'decimal': (decode_decimal, DecimalHandler.default),
+    'boolean': (_boolean, BooleanHandler.default),
+    'date': (decode_date, DateHandler.default),
+    'dateTime': (iso8601.parse_date, DateTimeHandler.default),
+    'timestamp': (decode_timestamp, TimestampHandler.default),
+}
+
+
+class ColumnProcessor(object):
+    """
+    Parser callbacks that put objects of a list response straight into
+    a `ColumnBatch`, with no dict per object. Scalars are decoded right
+    into their columns, nested objects are walked with a name prefix.
+    Arrays, HTML fields and mixed content are rare and are handed to
+    an `XmlProcessor` element-wise. Fields filtered out by the batch
+    are skipped without decoding.
+    """
+
+    def __init__(self, batch, document=None, position=None,
+                 raw_fields=HTML_FIELDS, types=None):
+        self.batch = batch
+        self._document = document
+        self._position = position
+        self._raw_fields = raw_fields
+        self._types = types
+        self._wanted = None
+        if batch.fields is not None:
+            # names and prefixes of nested objects leading to them
+            self._wanted = set(batch.fields)
+            for name in batch.fields:
+                parts = name.split('.')
+                for i in range(1, len(parts)):
+                    self._wanted.add('.'.join(parts[:i]) + '.')
+        self._in_root = False
+        # name prefix and declared field types of each open object
+        self._prefixes = []
+        self._fields = []
+        # open scalar element: full name, attrs, decoder, default, text
+        self._leaf = None
+        self._leaf_name = None
+        self._leaf_attrs = None
+        self._decoder = None
+        self._default = None
+        self._text = []
+        # element being parsed by an `XmlProcessor`
+        self._sub = None
+        self._sub_name = None
+        self._sub_depth = 0
+        self._skip = 0
+
+    def startElement(self, name, attrs):
+        if self._skip:
+            self._skip += 1
+            return
+        if self._sub is not None:
+            self._sub_depth += 1
+            self._sub.startElement(name, attrs)
+            return
+
+        prefixes = self._prefixes
+        if not prefixes:
+            if self._in_root:
+                prefixes.append('')
+                self._fields.append(self._types and self._types.get(name))
+            elif attrs.get('type') == 'array':
+                self._in_root = True
+            else:
+                raise ValueError("<%s> is not a list response" % name)
+            return
+
+        leaf = self._leaf
+        if leaf is not None:
+            if self._decoder is not None:
+                raise NotImplementedError(
+                    "Elements with type=%s are not expected to have "
+                    "nested elements" % self._leaf_attrs.get('type'))
+            self._leaf = None
+            if ''.join(self._text).strip():
+                self._delegate(self._leaf_name, leaf, self._leaf_attrs,
+                               position=False)
+                for content in self._text:
+                    self._sub.characters(content)
+                self._sub_depth += 1
+                self._sub.startElement(name, attrs)
+                return
+            prefixes.append(leaf + '.')
+            self._fields.append(
+                self._types and self._types.get(self._leaf_name))
+
+        full_name = prefixes[-1] + name
+        decoder = None
+        if attrs:
+            if attrs.get('nil') == 'true':
+                decoder, default = _nil, None
+            else:
+                type_name = attrs.get('type')
+                if type_name == 'array':
+                    if self._skipped(full_name):
+                        return
+                    self._delegate(name, full_name, attrs)
+                    return
+                if type_name in _typed:
+                    decoder, default = _typed[type_name]
+        if decoder is None and 'type' not in attrs:
+            fields = self._fields[-1]
+            if fields and fields.get(name) in _typed:
+                decoder, default = _typed[fields[name]]
+        if decoder is None and name in self._raw_fields:
+            if self._skipped(full_name):
+                return
+            self._delegate(name, full_name, attrs)
+            return
+
+        wanted = self._wanted
+        if wanted is not None and full_name not in wanted and (
+                decoder is not None or full_name + '.' not in wanted):
+            self._skip = 1
+            return
+        self._leaf = full_name
+        self._leaf_name = name
+        self._leaf_attrs = attrs
+        self._decoder = decoder
+        if decoder is not None:
+            self._default = default
+        self._text = []
+
+    def endElement(self, name):
+        if self._skip:
+            self._skip -= 1
+            return
+        sub = self._sub
+        if sub is not None:
+            sub.endElement(name)
+            self._sub_depth -= 1
+            if not self._sub_depth:
+                self._sub = None
+                self.batch._put(self._sub_name, sub.data())
+            return
+
+        leaf = self._leaf
+        if leaf is not None:
+            self._leaf = None
+            text = ''.join(self._text)
+            decoder = self._decoder
+            if decoder is None:
+                value = NoTypeHandler.wspace_re.sub(' ', text).strip() or None
+            else:
+                text = text.strip()
+                value = decoder(text) if text else self._default
+            self.batch._put(leaf, value)
+            return
+
+        prefixes = self._prefixes
+        if prefixes:
+            prefixes.pop()
+            self._fields.pop()
+            if not prefixes:
+                self.batch._end_row()
+
+    def characters(self, content):
+        if self._skip:
+            return
+        if self._sub is not None:
+            self._sub.characters(content)
+        elif self._leaf is not None:
+            self._text.append(content)
+
+    def startCDATA(self):
+        if self._sub is not None:
+            self._sub.startCDATA()
+
+    def data(self):
+        return self.batch
+
+    def _skipped(self, full_name):
+        if self._wanted is not None and full_name not in self._wanted:
+            self._skip = 1
+            return True
+        return False
+
+    def _delegate(self, name, full_name, attrs, position=True):
+        # HTML is sliced from the current offset, so it's only captured
+        # if the element is delegated right on its start
+        if position:
+            sub = XmlProcessor(self._document, self._position,
+                               self._raw_fields, self._types)
+        else:
+            sub = XmlProcessor(types=self._types)
+        sub.startElement(name, attrs)
+        self._sub = sub
+        self._sub_name = full_name
+        self._sub_depth = 1
+
+
+def parse_columns(xml_string, **kwargs):
+    "Parse a list response straight into a `ColumnBatch`"
+    batch = ColumnBatch(**kwargs)
+    batch.extend_xml(xml_string)
+    return batch
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for array export: "
+                          "pip install pyinsales[columnar]")
+    return numpy
@@ -1,18 +1,28 @@
 # -*- coding: utf-8; -*-
 
 import datetime
+import os
 import xml.etree.ElementTree as et
 
+from base64 import b64encode
 from collections.abc import Mapping, Sequence
 from decimal import Decimal
 
 
-def compose(data, root, arrays={}):
-    root_e = compose_element(root, data, arrays)
+def compose(data, root, arrays={}, types={}):
+    """
+    `types` is an XML root to `{field: InSales type name}` table, see
+    `insales.schema.field_types`: numbers put to decimal fields are
+    sent as decimals
+    """
+    root_e = compose_element(root, data, arrays, types)
     return et.tostring(root_e, 'utf-8')
 
-def compose_element(key, value, arrays={}):
+def compose_element(key, value, arrays={}, types={}, field_type=None):
     e = et.Element(key)
+    if (field_type == 'decimal' and isinstance(value, (int, float))
+            and not isinstance(value, bool)):
+        value = Decimal(str(value))
     if isinstance(value, str):
         e.text = value
     elif isinstance(value, bool):
@@ -36,10 +46,62 @@ def compose_element(key, value, arrays={}):
         e.attrib['type'] = 'array'
         e_key = arrays[key]
         for x in value:
-            e.append(compose_element(e_key, x, arrays))
+            e.append(compose_element(e_key, x, arrays, types))
     elif isinstance(value, Mapping):
+        fields = types.get(key, {})
         for key, value in value.items():
-            e.append(compose_element(key, value, arrays))
+            e.append(compose_element(key, value, arrays, types,
+                                     fields.get(key)))
     else:
         raise TypeError("Value %r has unsupported type %s" % (value, type(value)))
     return e
+
+
+class AttachmentBody(object):
+    """
+    Request body for an element with a base64 encoded file in it,
+    e.g. an image `attachment`. The file is read and encoded chunk by
+    chunk while the request is being sent, so only a small buffer is
+    held in memory. The body may be iterated several times, which
+    lets the connection retry the request.
+
+    `file` is a path or a seekable binary file object.
+    """
+
+    placeholder = 'PYINSALES-ATTACHMENT-PLACEHOLDER'
+    chunk_size = 3 * 64 * 1024
+
+    def __init__(self, file, data, root, field='attachment', arrays={},
+                 types={}):
+        self.file = file
+        xml = compose(dict(data, **{field: self.placeholder}), root, arrays,
+                      types)
+        self.head, self.tail = xml.split(self.placeholder.encode('utf-8'))
+        if isinstance(file, str):
+            self.offset = 0
+            self.size = os.path.getsize(file)
+        else:
+            self.offset = file.tell()
+            self.size = file.seek(0, os.SEEK_END) - self.offset
+            file.seek(self.offset)
+
+    def __len__(self):
+        encoded_size = (self.size + 2) // 3 * 4
+        return len(self.head) + encoded_size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        if isinstance(self.file, str):
+            with open(self.file, 'rb') as f:
+                yield from self._encode(f)
+        else:
+            self.file.seek(self.offset)
+            yield from self._encode(self.file)
+        yield self.tail
+
+    def _encode(self, f):
+        while True:
+            chunk = f.read(self.chunk_size)
+            if not chunk:
+                return
+            yield b64encode(chunk)
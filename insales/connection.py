@@ -1,17 +1,8 @@
 # -*- coding: utf-8; -*-
 
 import datetime
-import time
-import threading
-import socket
 
-from base64 import b64encode
-
-from urllib import parse as urlparse
-from http.client import HTTPConnection, HTTPSConnection, HTTPException
-
-
-insales_lock = threading.Lock()
+from insales.throttling import scheduler_for
 
 
 def throttle_fn(curr: int, limit: int):
@@ -29,7 +20,7 @@ class Connection(object):
                  secure=False,
                  retry_on_503=False, retry_on_socket_error=False,
                  retry_timeout=1, response_timeout=10,
-                 throttle=False):
+                 throttle=False, scheduler=None, reserve=0):
         self.account = account
         self.api_key = api_key
         self.password = password
@@ -38,26 +29,26 @@ class Connection(object):
         self.retry_on_socket_error = retry_on_socket_error
         self.retry_timeout = datetime.timedelta(seconds=retry_timeout)
         self.response_timeout = response_timeout
-        self.last_req_time = datetime.datetime.now()
-        self.retry_after = datetime.datetime.now()
+        self.scheduler = scheduler or scheduler_for(account, api_key)
         self.max_wait_time = datetime.timedelta(seconds=60)
         self.throttle = throttle != False
         self.throttle_fn = throttle if callable(throttle) else throttle_fn
+        # Share of the usage limit kept for non-bulk requests: with
+        # throttling on, bulk ones are paced as if the limit was lower
+        self.reserve = reserve
 
     def get_retry_after(self):
-        return self.retry_after
+        return self.scheduler.get_retry_after()
 
     def _set_retry_after(self, delta):
-        with insales_lock:
-            self.retry_after = self.last_req_time + min(
-                delta, self.max_wait_time
-            )
+        self.scheduler.set_retry_after(
+            min(delta, self.max_wait_time).total_seconds()
+        )
 
     def _increase_retry_after(self, delta):
-        with insales_lock:
-            self.retry_after = max(self.last_req_time, self.retry_after) + min(
-                delta, self.max_wait_time
-            )
+        self.scheduler.increase_retry_after(
+            min(delta, self.max_wait_time).total_seconds()
+        )
 
     def _apply_retry_timeout(self):
         self._set_retry_after(self.retry_timeout)
@@ -74,27 +65,44 @@ class Connection(object):
 
         try:
             curr_str, limit_str = header.split("/")
-            delta = datetime.timedelta(seconds=self.throttle_fn(
-                int(curr_str),
-                int(limit_str),
-            ))
+            curr, limit = int(curr_str), int(limit_str)
+            self.scheduler.usage = (curr, limit)
+            if not self.throttle:
+                return
+            delta = datetime.timedelta(seconds=self.throttle_fn(curr, limit))
             self._increase_retry_after(delta)
+            if self.reserve:
+                bulk_limit = max(1, int(limit * (1 - self.reserve)))
+                # `throttle_fn` is only meant for usage up to the limit,
+                # past it it grows without bound
+                delta = datetime.timedelta(seconds=self.throttle_fn(
+                    min(curr, bulk_limit), bulk_limit))
+                self.scheduler.increase_bulk_retry_after(
+                    min(delta, self.max_wait_time).total_seconds()
+                )
         except ValueError:
             pass
 
     def _wait_until_retry_after(self):
-        delta = self.retry_after - datetime.datetime.now()
-        if delta.total_seconds() > 0:
-            time.sleep(delta.total_seconds())
+        self.scheduler.acquire()
 
 
     def request(self, method, endpoint, qargs={}, data=None):
+        # network modules are imported on first request to keep
+        # `import insales` cheap
+        import socket
+        from base64 import b64encode
+        from http.client import HTTPConnection, HTTPSConnection, HTTPException
+
         path = self.format_path(endpoint, qargs)
         auth = b64encode(u"{0}:{1}".format(self.api_key, self.password).encode('utf-8')).decode('utf-8')
         headers = {
             'Authorization': 'Basic {0}'.format(auth),
             'Content-Type': 'application/xml'
         }
+        if data is not None:
+            # streamed bodies know their size, let http.client send them as is
+            headers['Content-Length'] = str(len(data))
 
         done = False
         while not done:
@@ -105,8 +113,6 @@ class Connection(object):
                     conn = HTTPSConnection(host, timeout=self.response_timeout)
                 else:
                     conn = HTTPConnection(host, timeout=self.response_timeout)
-                with insales_lock:
-                    self.last_req_time = datetime.datetime.now()
                 conn.request(method, path, headers=headers, body=data)
                 resp = conn.getresponse()
                 body = resp.read()
@@ -117,8 +123,7 @@ class Connection(object):
                 else:
                     raise
 
-            if self.throttle:
-                self._apply_usage_limit(resp.getheader('API-Usage-Limit'))
+            self._apply_usage_limit(resp.getheader('API-Usage-Limit'))
 
             if resp.status == 503 and self.retry_on_503:
                 retry_after_header = resp.getheader('Retry-After')
@@ -143,6 +148,8 @@ class Connection(object):
             )
 
     def format_path(self, endpoint, qargs):
+        from urllib import parse as urlparse
+
         for key, val in qargs.items():
             if isinstance(val, datetime.datetime):
                 qargs[key] = val.replace(microsecond=0).isoformat()
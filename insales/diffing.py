@@ -0,0 +1,98 @@
+# -*- coding: utf-8; -*-
+
+import hashlib
+import threading
+
+from collections.abc import Mapping
+
+
+def diff(old, new):
+    """
+    Fields of `new` whose values differ from `old`. Nested objects are
+    compared field by field, arrays as a whole: InSales replaces array
+    contents on update, so a changed array is sent completely.
+    """
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta[key] = value
+            continue
+        current = old[key]
+        if isinstance(value, Mapping) and isinstance(current, Mapping):
+            nested = diff(current, value)
+            if nested:
+                delta[key] = nested
+        elif type(value) is bool or type(current) is bool:
+            if type(value) is not type(current) or value != current:
+                delta[key] = value
+        elif value != current:
+            delta[key] = value
+    return delta
+
+
+class ChangeTracker(object):
+    """
+    Turns updates into minimal writes. For every endpoint it keeps the
+    last known server state and a digest of the last payload that was
+    applied:
+
+     * a payload identical to the last applied one is skipped without
+       any write, the last known state is returned (read first if the
+       digest comes from an earlier run);
+     * otherwise it's compared with the known state (fetched first if
+       `fetch` is set and nothing is known yet) and only changed fields
+       are sent, or nothing at all.
+
+    `hashes` may be any mutable mapping, e.g. a `shelve`, so that the
+    digests survive between runs. Mind that a digest is trusted as is:
+    if the object was changed on the server since (e.g. stock sold),
+    sending the same payload again is still skipped. Call `forget` for
+    such endpoints, or don't persist the digests. Install with
+    `InSalesApi(connection, tracker=ChangeTracker())`.
+    """
+
+    def __init__(self, fetch=True, hashes=None):
+        self.fetch = fetch
+        self.hashes = {} if hashes is None else hashes
+        self.states = {}
+        self._lock = threading.Lock()
+
+    def update(self, api, endpoint, data, root):
+        digest = hashlib.sha1(api._compose(data, root)).hexdigest()
+        key = '%s %s' % (root, endpoint)
+        with self._lock:
+            skip = self.hashes.get(key) == digest
+            state = self.states.get(endpoint)
+
+        if skip:
+            if state is None:
+                # digest from an earlier run, the object is still
+                # returned as with any update
+                state = api._get(endpoint)
+                if state is not None:
+                    with self._lock:
+                        self.states[endpoint] = state
+            return state
+
+        if state is None and self.fetch:
+            state = api._get(endpoint)
+
+        delta = diff(state, data) if state is not None else data
+        if delta:
+            result = api._put(endpoint, delta, root)
+        else:
+            result = state
+
+        with self._lock:
+            if result is not None:
+                self.states[endpoint] = result
+            self.hashes[key] = digest
+        return result
+
+    def forget(self, endpoint):
+        "Drop the known state and payload digests of `endpoint`"
+        suffix = ' ' + endpoint
+        with self._lock:
+            self.states.pop(endpoint, None)
+            for key in [key for key in self.hashes if key.endswith(suffix)]:
+                del self.hashes[key]
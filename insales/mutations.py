@@ -0,0 +1,288 @@
+# -*- coding: utf-8; -*-
+
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from insales.api import InSalesApi
+from insales.batch import map_calls
+
+
+class UnknownOutcome(Exception):
+    """
+    A create was being sent when its flush was interrupted, it may or
+    may not have been applied. Creates aren't idempotent, so it's not
+    sent again: check the server, then `MutationQueue.retry` or
+    `MutationQueue.discard` it.
+    """
+
+
+class Outcome(object):
+    "Result of sending a queued mutation"
+    __slots__ = ('id', 'method', 'endpoint', 'result', 'error')
+
+    def __init__(self, id, method, endpoint, result=None, error=None):
+        self.id = id
+        self.method = method
+        self.endpoint = endpoint
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else 'error=%r' % self.error
+        return "<Outcome #%d %s %s %s>" % (
+            self.id, self.method.upper(), self.endpoint, status)
+
+
+def merge(old, new):
+    "Update `old` with `new`, nested objects are merged, arrays replaced"
+    merged = dict(old)
+    for key, value in new.items():
+        current = merged.get(key)
+        if isinstance(value, Mapping) and isinstance(current, Mapping):
+            value = merge(current, value)
+        merged[key] = value
+    return merged
+
+
+class MutationQueue(object):
+    """
+    Write-behind queue of create, update and delete requests journaled
+    in SQLite, so pending mutations survive restarts. An update to an
+    object that already has an update pending is merged into it and
+    shares its id. Nothing is sent until `flush`.
+
+    Several queues, also in different processes, may share a journal:
+    a flush leases the mutations it sends for `lease` seconds, and
+    other flushes leave them alone meanwhile. Updates and deletes whose
+    lease ran out, e.g. after a crash, are sent again; creates are
+    reported with `UnknownOutcome` instead.
+
+    >>> queue = MutationQueue(api, 'mutations.sqlite')
+    >>> deferred = queue.deferred()
+    >>> deferred.update_product_variant(1, 2, {'quantity': 5})
+    >>> deferred.update_product_variant(1, 2, {'price': 100})
+    >>> queue.flush()   # a single PUT with both fields
+    """
+
+    def __init__(self, api, path=':memory:', lease=600):
+        self.api = api
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS mutations ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " method TEXT NOT NULL,"
+                " endpoint TEXT NOT NULL,"
+                " root TEXT,"
+                " data BLOB,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " last_error TEXT,"
+                # pending, sending (by `owner` until `lease_until`)
+                # or unknown, see `UnknownOutcome`
+                " state TEXT NOT NULL DEFAULT 'pending',"
+                " owner TEXT,"
+                " lease_until REAL)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS mutations_endpoint"
+                " ON mutations (endpoint, id)")
+
+    def close(self):
+        self._db.close()
+
+    def deferred(self):
+        "`InSalesApi` whose writes go to this queue, see `DeferredApi`"
+        return DeferredApi(self)
+
+    def add(self, endpoint, data, root):
+        return self._insert('post', endpoint, data, root)
+
+    def update(self, endpoint, data, root):
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT id, method, root, data, state FROM mutations"
+                " WHERE endpoint = ? ORDER BY id DESC LIMIT 1",
+                (endpoint,)).fetchone()
+            # a row being sent by `flush` is never changed, fields added
+            # to it now would be deleted along with it unsent
+            if (row is not None and row[1] == 'put' and row[2] == root
+                    and row[4] == 'pending'):
+                merged = merge(pickle.loads(row[3]), data)
+                self._db.execute(
+                    "UPDATE mutations SET data = ? WHERE id = ?",
+                    (pickle.dumps(merged), row[0]))
+                return row[0]
+            return self._insert_row('put', endpoint, data, root)
+
+    def delete(self, endpoint):
+        return self._insert('delete', endpoint, None, None)
+
+    def discard(self, mutation_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM mutations WHERE id = ?",
+                             (mutation_id,))
+
+    def retry(self, mutation_id):
+        "Send a mutation with an unknown outcome again on the next flush"
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE mutations SET state = 'pending'"
+                " WHERE id = ? AND state = 'unknown'", (mutation_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM mutations").fetchone()[0]
+
+    def flush(self, workers=4, limit=None):
+        """
+        Send pending mutations, at most `limit` of them, and return their
+        `Outcome`s in queue order. Mutations run concurrently on `workers`
+        threads sharing the api's throttling, except that updates and
+        deletes of the same object run in queue order. After a failure the
+        object's later mutations are left pending, as is the failed one.
+        Every create is independent of the others. Creates with an
+        unknown outcome are reported by every flush until resolved.
+
+        Mutations queued while a flush runs are left to the next one.
+        """
+        owner = uuid.uuid4().hex
+        now = time.time()
+        # claim pending mutations, and updates and deletes whose lease
+        # ran out; skip objects another flush is still busy with to keep
+        # their mutations in order
+        claim = ("UPDATE mutations SET state = 'sending', owner = :owner,"
+                 " lease_until = :until WHERE id IN ("
+                 "  SELECT id FROM mutations"
+                 "  WHERE (state = 'pending' OR (state = 'sending'"
+                 "   AND lease_until < :now AND method != 'post'))"
+                 "  AND (method = 'post' OR endpoint NOT IN ("
+                 "   SELECT endpoint FROM mutations"
+                 "   WHERE state = 'sending' AND lease_until >= :now"
+                 "   AND method != 'post'))"
+                 "  ORDER BY id")
+        if limit is not None:
+            claim += " LIMIT %d" % int(limit)
+        claim += ")"
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE mutations SET state = 'unknown', owner = NULL"
+                " WHERE state = 'sending' AND lease_until < ?"
+                " AND method = 'post'", (now,))
+            self._db.execute(claim, {'owner': owner, 'now': now,
+                                     'until': now + self.lease})
+            rows = self._db.execute(
+                "SELECT id, method, endpoint, root, data FROM mutations"
+                " WHERE state = 'sending' AND owner = ? ORDER BY id",
+                (owner,)).fetchall()
+            unknown = self._db.execute(
+                "SELECT id, method, endpoint FROM mutations"
+                " WHERE state = 'unknown' ORDER BY id").fetchall()
+
+        groups = OrderedDict()
+        for row in rows:
+            # creates post to a shared collection endpoint but concern
+            # different objects, so each one is a group of its own
+            key = row[0] if row[1] == 'post' else row[2]
+            groups.setdefault(key, []).append(row)
+
+        outcomes = [Outcome(id, method, endpoint, error=UnknownOutcome(
+                        "create #%d was interrupted" % id))
+                    for id, method, endpoint in unknown]
+        for item in map_calls(self._send_group, groups.values(),
+                              workers=workers):
+            outcomes.extend(item.result)
+        outcomes.sort(key=lambda outcome: outcome.id)
+        return outcomes
+
+    def _send_group(self, rows):
+        outcomes = []
+        try:
+            for id, method, endpoint, root, data in rows:
+                self._renew_lease(id)
+                outcome = Outcome(id, method, endpoint)
+                try:
+                    outcome.result = self._send(method, endpoint, root,
+                                                pickle.loads(data))
+                except Exception as e:
+                    outcome.error = e
+                self._record(outcome)
+                outcomes.append(outcome)
+                if not outcome.ok:
+                    break
+        finally:
+            # rows left unsent after a failure go back to the queue
+            with self._lock, self._db:
+                self._db.executemany(
+                    "UPDATE mutations SET state = 'pending', owner = NULL"
+                    " WHERE id = ?",
+                    [(row[0],) for row in rows[len(outcomes):]])
+        return outcomes
+
+    def _send(self, method, endpoint, root, data):
+        if method == 'post':
+            return self.api._add(endpoint, data, root)
+        if method == 'put':
+            return self.api._update(endpoint, data, root)
+        return self.api._delete(endpoint)
+
+    def _record(self, outcome):
+        with self._lock, self._db:
+            if outcome.ok:
+                self._db.execute("DELETE FROM mutations WHERE id = ?",
+                                 (outcome.id,))
+            else:
+                self._db.execute(
+                    "UPDATE mutations SET attempts = attempts + 1,"
+                    " last_error = ?, state = 'pending', owner = NULL"
+                    " WHERE id = ?",
+                    (repr(outcome.error), outcome.id))
+
+    def _renew_lease(self, mutation_id):
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE mutations SET lease_until = ? WHERE id = ?",
+                (time.time() + self.lease, mutation_id))
+
+    def _insert(self, method, endpoint, data, root):
+        with self._lock, self._db:
+            return self._insert_row(method, endpoint, data, root)
+
+    def _insert_row(self, method, endpoint, data, root):
+        cursor = self._db.execute(
+            "INSERT INTO mutations (method, endpoint, root, data)"
+            " VALUES (?, ?, ?, ?)",
+            (method, endpoint, root, pickle.dumps(data)))
+        return cursor.lastrowid
+
+
+class DeferredApi(InSalesApi):
+    """
+    `InSalesApi` that queues create, update and delete calls in a
+    `MutationQueue` and returns mutation ids instead of server
+    responses. Reads are sent right away.
+    """
+
+    def __init__(self, queue):
+        super(DeferredApi, self).__init__(queue.api.connection)
+        self.queue = queue
+
+    def _add(self, endpoint, data, root):
+        return self.queue.add(endpoint, data, root)
+
+    def _update(self, endpoint, data, root):
+        return self.queue.update(endpoint, data, root)
+
+    def _delete(self, endpoint):
+        return self.queue.delete(endpoint)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8; -*-
+
+from insales.connection import throttle_fn
+
+
+class AdaptivePager(object):
+    """
+    Tunes `per_page` of a paginated endpoint from what it observes:
+
+     * while objects per second keep growing and a page comes back
+       within `target_latency` seconds, the page size is doubled up to
+       `max_per_page` (the server maximum);
+     * if throughput drops, it returns to the best size seen so far;
+     * a slow page or a failed request halves the size.
+
+    It also paces requests: when the last `API-Usage-Limit` header
+    shows usage above `usage_high`, `delay` suggests a pause before the
+    next page; it is ignored when the connection throttles requests
+    itself. Pass it to `InSalesApi.iterate_over_all(pager=...)`.
+    """
+
+    def __init__(self, per_page=25, min_per_page=10, max_per_page=250,
+                 target_latency=5.0, usage_high=0.8, throttle=throttle_fn):
+        self.per_page = per_page
+        self.min_per_page = min_per_page
+        self.max_per_page = max_per_page
+        self.target_latency = target_latency
+        self.usage_high = usage_high
+        self.throttle = throttle
+        self.delay = 0
+        self._best_rate = 0
+        self._best_per_page = per_page
+
+    def observe(self, count, latency, usage=None):
+        "Account for a page of `count` objects fetched in `latency` seconds"
+        self.delay = 0
+        if usage is not None:
+            curr, limit = usage
+            if limit and curr / limit >= self.usage_high:
+                self.delay = self.throttle(curr, limit)
+
+        if count < self.per_page:
+            # the last page says nothing about throughput
+            return
+
+        rate = count / max(latency, 1e-3)
+        if latency > self.target_latency:
+            self.per_page = max(self.min_per_page, self.per_page // 2)
+        elif rate >= self._best_rate:
+            self._best_rate = rate
+            self._best_per_page = self.per_page
+            self.per_page = min(self.max_per_page, self.per_page * 2)
+        else:
+            self.per_page = self._best_per_page
+
+    def failed(self):
+        """
+        Halve the page size after a failed request. Returns False if it
+        can't be reduced any further, i.e. retrying makes no sense.
+        """
+        if self.per_page <= self.min_per_page:
+            return False
+        self.per_page = max(self.min_per_page, self.per_page // 2)
+        self._best_rate = 0
+        self._best_per_page = self.per_page
+        return True
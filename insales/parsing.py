@@ -3,9 +3,9 @@
 from decimal import Decimal
 from collections import deque
 from copy import copy
-from io import BytesIO
+from functools import lru_cache
 
-import xml.sax
+import xml.parsers.expat
 import xml.sax.handler
 
 import datetime
@@ -13,6 +13,20 @@ import re
 import iso8601
 
 
+# Fields that carry unescaped HTML. When such an element has nested
+# markup its value is the original document slice rather than a rebuilt
+# string, see `XmlProcessor`
+HTML_FIELDS = frozenset([
+    'description',
+    'short-description',
+    'content',
+])
+
+start_tag_re = re.compile(rb"""<[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>""")
+encoding_re = re.compile(
+    rb"""\s*<\?xml[^>]*?\sencoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
+
+
 def format_open_tag(name, attrs):
     attrs = [u'%s="%s"' % attr for attr in attrs.items()]
     return u"<%s %s>" % (name, ' '.join(attrs))
@@ -145,7 +159,7 @@ class DecimalHandler(ElementHandler):
     default = Decimal(0)
 
     def on_content(self, content):
-        self.value = Decimal(content.strip())
+        self.value = decode_decimal(content.strip())
 
 
 class BooleanHandler(ElementHandler):
@@ -161,19 +175,15 @@ class DateHandler(ElementHandler):
     default = None
 
     def on_content(self, content):
-        self.value = datetime.datetime.strptime(content.strip(), "%Y-%m-%d")
+        self.value = decode_date(content.strip())
 
 
 class TimestampHandler(ElementHandler):
     type_name = 'timestamp'
     default = None
-    date_re = re.compile(r"\s+\+(\d\d)(\d\d)$")
 
     def on_content(self, content):
-        # convert 2010-08-16 18:39:58 +0400
-        # to      2010-08-16 18:39:58+04:00
-        string = self.date_re.sub(r"+\1:\2", content.strip())
-        self.value = iso8601.parse_date(string)
+        self.value = decode_timestamp(content.strip())
 
 class DateTimeHandler(ElementHandler):
     type_name = 'dateTime'
@@ -183,6 +193,54 @@ class DateTimeHandler(ElementHandler):
         self.value = iso8601.parse_date(content.strip())
 
 
+# Decoders below memoize recently seen strings: pages are full of
+# repeated values (same second, same price). All results are immutable
+# so sharing them between objects is safe
+
+DECODER_CACHE_SIZE = 4096
+
+decode_decimal = lru_cache(maxsize=DECODER_CACHE_SIZE)(Decimal)
+
+
+@lru_cache(maxsize=DECODER_CACHE_SIZE)
+def decode_date(string):
+    if len(string) == 10 and string[4] == '-' and string[7] == '-':
+        return datetime.datetime(
+            int(string[0:4]), int(string[5:7]), int(string[8:10]))
+    return datetime.datetime.strptime(string, "%Y-%m-%d")
+
+
+timestamp_re = re.compile(r"\s+([+-])(\d\d)(\d\d)$")
+_timezones = {}
+
+
+def timezone_for(offset):
+    "tzinfo for `+HHMM` or `-HHMM`, built the way iso8601 does and shared"
+    tz = _timezones.get(offset)
+    if tz is None:
+        hours, minutes = int(offset[1:3]), int(offset[3:5])
+        name = "%s%02d:%02d" % (offset[0], hours, minutes)
+        if offset[0] == '-':
+            hours, minutes = -hours, -minutes
+        tz = _timezones[offset] = iso8601.iso8601.FixedOffset(hours, minutes, name)
+    return tz
+
+
+@lru_cache(maxsize=DECODER_CACHE_SIZE)
+def decode_timestamp(string):
+    # InSales sends 2010-08-16 18:39:58 +0400
+    if (len(string) == 25 and string[10] == ' ' and string[19] == ' '
+            and string[20] in '+-'):
+        return datetime.datetime(
+            int(string[0:4]), int(string[5:7]), int(string[8:10]),
+            int(string[11:13]), int(string[14:16]), int(string[17:19]),
+            tzinfo=timezone_for(string[20:25]),
+        )
+    # convert 2010-08-16 18:39:58 +0400
+    # to      2010-08-16 18:39:58+04:00
+    return iso8601.parse_date(timestamp_re.sub(r"\1\2:\3", string))
+
+
 all_handlers = [
     NoTypeHandler,
     ArrayHandler,
@@ -204,36 +262,146 @@ def handler_for(attrs):
     return type2handler.get(type_name, NoTypeHandler)()
 
 
+class RawCapture(object):
+    "Tracks an HTML-bearing element whose markup is sliced from the document"
+    __slots__ = ('start', 'depth', 'nested', 'cdata', 'text', 'value')
+
+    def __init__(self, start):
+        self.start = start
+        self.depth = 0
+        self.nested = False
+        self.cdata = False
+        self.text = NoTypeHandler()
+        self.value = None
+
+
 class XmlProcessor(xml.sax.handler.ContentHandler):
-    def __init__(self):
+    def __init__(self, document=None, position=None, raw_fields=HTML_FIELDS,
+                 types=None):
         xml.sax.handler.ContentHandler.__init__(self)
         self._handler_stack = deque([NoTypeHandler()])
+        self._document = document
+        self._position = position
+        self._raw_fields = raw_fields if position is not None else ()
+        self._raw = None
+        self._encoding = None
+        # XML root to {field: type name}, see `insales.schema.field_types`;
+        # used for elements without a type attribute. The stack holds
+        # the fields of each open element
+        self._types = types
+        self._fields_stack = deque([None]) if types else None
 
     def startElement(self, name, attrs):
+        raw = self._raw
+        if raw is not None:
+            raw.depth += 1
+            raw.nested = True
+            return
         head = self._handler_stack[-1]
-        new_head = head.on_nested_start(name, attrs)
+        if (name in self._raw_fields and type(head) is NoTypeHandler
+                and not head._string_parts
+                and 'type' not in attrs and 'nil' not in attrs):
+            tag = start_tag_re.match(self._document, self._position())
+            self._raw = RawCapture(tag.end())
+            return
+        fields_stack = self._fields_stack
+        if fields_stack is None:
+            new_head = head.on_nested_start(name, attrs)
+        else:
+            fields = fields_stack[-1]
+            handler_class = fields and type2handler.get(fields.get(name))
+            if (handler_class and type(head) is NoTypeHandler
+                    and not head._string_parts
+                    and 'type' not in attrs and 'nil' not in attrs):
+                new_head = handler_class()
+            else:
+                new_head = head.on_nested_start(name, attrs)
+            fields_stack.append(self._types.get(name))
         self._handler_stack.append(new_head)
 
     def endElement(self, name):
+        raw = self._raw
+        if raw is not None:
+            if raw.depth:
+                raw.depth -= 1
+                return
+            self._raw = None
+            if raw.nested and raw.cdata:
+                # a slice would keep CDATA markup, parse it instead
+                raw.value = self._parse_slice(name, raw.start)
+            elif raw.nested:
+                markup = self._document[raw.start:self._position()]
+                raw.value = markup.decode(self._document_encoding()).strip()
+            else:
+                raw.value = raw.text.value
+            self._handler_stack[-1].on_nested_end(name, raw)
+            return
         h = self._handler_stack.pop()
+        if self._fields_stack is not None:
+            self._fields_stack.pop()
         self._handler_stack[-1].on_nested_end(name, h)
 
     def characters(self, content):
+        raw = self._raw
+        if raw is not None:
+            if not raw.nested:
+                raw.text.on_content(content)
+            return
         self._handler_stack[-1].on_content(content)
 
+    def startCDATA(self):
+        if self._raw is not None:
+            self._raw.cdata = True
+
     def data(self):
         top_dict = self._handler_stack[0].value
         if top_dict:
             return list(top_dict.values())[0]
 
-
-def parse(xml_string):
-    processor = XmlProcessor()
-    io = BytesIO(xml_string)
-
-    parser = xml.sax.make_parser()
-    parser.setContentHandler(processor)
-    for line in io:
-        parser.feed(line)
-
-    return processor.data()
+    def _document_encoding(self):
+        if self._encoding is None:
+            match = encoding_re.match(self._document)
+            self._encoding = 'utf-8'
+            if match:
+                self._encoding = match.group(1).decode('ascii')
+        return self._encoding
+
+    def _parse_slice(self, name, start):
+        encoding = self._document_encoding()
+        head = '<?xml version="1.0" encoding="%s"?><%s>' % (encoding, name)
+        tail = '</%s>' % name
+        markup = self._document[start:self._position()]
+        return parse(head.encode('ascii') + markup + tail.encode('ascii'),
+                     raw_fields=())
+
+
+def parse(xml_string, raw_fields=HTML_FIELDS, processor=XmlProcessor,
+          types=None):
+    """
+    Parse an API response. `processor` is called with the document,
+    a position callback, `raw_fields` and `types` and must return an
+    object with the callbacks of `XmlProcessor`; its `data()` is the
+    result
+    """
+    if not xml_string.strip():
+        # e.g. an empty body of a DELETE response
+        return None
+    if isinstance(xml_string, str):
+        xml_string = xml_string.encode('utf-8')
+
+    parser = xml.parsers.expat.ParserCreate()
+    # deliver each run of text in one piece, typed handlers expect it
+    parser.buffer_text = True
+    xml_processor = processor(
+        xml_string,
+        lambda: parser.CurrentByteIndex,
+        raw_fields,
+        types,
+    )
+    parser.StartElementHandler = xml_processor.startElement
+    parser.EndElementHandler = xml_processor.endElement
+    parser.CharacterDataHandler = xml_processor.characters
+    parser.StartCdataSectionHandler = xml_processor.startCDATA
+    parser.Parse(xml_string, True)
+
+    return xml_processor.data()
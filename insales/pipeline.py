@@ -0,0 +1,144 @@
+# -*- coding: utf-8; -*-
+
+import copy
+import inspect
+import os
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from insales import schema
+from insales.coalescing import SingleFlight
+from insales.parsing import parse
+
+
+def _raw_response(response):
+    return response
+
+
+class ParsePipeline(object):
+    """
+    Fetches pages on I/O threads and parses them on a process pool,
+    so parsing of large backfills isn't bound to a single core by
+    the GIL. Parsed pages come back pickled by the process pool and
+    are yielded strictly in page order.
+
+    >>> with ParsePipeline(api, processes=4) as pipeline:
+    ...     for order in pipeline.iterate_over_all('get_orders', per_page=250):
+    ...         handle(order)
+
+    Unlike `InSalesApi.iterate_over_all`, pages are addressed by
+    number rather than by `from_id` so that several can be in flight
+    at once. After the first page up to `window` pages are requested
+    ahead; once a page shorter than `per_page` is parsed no further
+    pages are requested and those not started yet are cancelled.
+
+    Parser processes are started with `mp_context`, forkserver or
+    spawn by default: they are launched from I/O threads while other
+    requests are running, and forking a multi-threaded process may
+    deadlock the child.
+    """
+
+    def __init__(self, api, processes=None, io_threads=4, window=None,
+                 mp_context=None):
+        self._api = copy.copy(api)
+        self._api._parse = _raw_response
+        self._api._flights = SingleFlight()
+        processes = processes or os.cpu_count() or 1
+        self._io = ThreadPoolExecutor(max_workers=io_threads)
+        self._parsers = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=mp_context or _default_mp_context())
+        self.window = window or io_threads + processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._io.shutdown(wait=True)
+        self._parsers.shutdown(wait=True)
+
+    def iterate_pages(self, method, page=1, **kwargs):
+        "Yield successive non-empty pages of a paginated `InSalesApi` method"
+        fetch = getattr(self._api, _method_name(method))
+        per_page = kwargs.get('per_page', _default_per_page(fetch))
+        # number of the first page known to be the last one
+        last = [None]
+        # the first page goes alone: often it's the only one
+        window = 1
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < window and (
+                        last[0] is None or page <= last[0]):
+                    pending.append(self._io.submit(
+                        self._fetch, fetch, dict(kwargs, page=page),
+                        per_page, last))
+                    page += 1
+                if not pending:
+                    return
+                parsing = pending.popleft().result()
+                if parsing is None:
+                    return
+                objects = parsing.result()
+                if objects:
+                    yield objects
+                if not objects or per_page and len(objects) < per_page:
+                    return
+                window = self.window
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def iterate_over_all(self, method, **kwargs):
+        for objects in self.iterate_pages(method, **kwargs):
+            yield from objects
+
+    def _fetch(self, fetch, kwargs, per_page, last):
+        page = kwargs['page']
+        if last[0] is not None and page > last[0]:
+            # past the end, don't spend a request on it
+            return None
+        # paginated methods return `[]` in place of an empty response
+        parsing = self._parsers.submit(_parse_page, fetch(**kwargs) or b'')
+
+        def note_last(parsing):
+            if parsing.cancelled() or parsing.exception() is not None:
+                return
+            count = len(parsing.result())
+            if not count or per_page and count < per_page:
+                if last[0] is None or page < last[0]:
+                    last[0] = page
+
+        parsing.add_done_callback(note_last)
+        return parsing
+
+
+def _parse_page(raw):
+    return parse(raw, types=schema.field_types()) or []
+
+
+def _method_name(method):
+    return method if isinstance(method, str) else method.__name__
+
+
+def _default_per_page(fetch):
+    "Default `per_page` of a method, None if it has no such argument"
+    try:
+        parameter = inspect.signature(fetch).parameters.get('per_page')
+    except (TypeError, ValueError):
+        return None
+    if parameter is None or parameter.default is parameter.empty:
+        return None
+    return parameter.default
+
+
+def _default_mp_context():
+    import multiprocessing
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8; -*-
+
+"""
+Bundled description of InSales API resources (schema.json): REST
+paths, XML roots, array element names and field types. Nothing is
+read until first use, and methods are built only when accessed.
+"""
+
+import os
+
+from collections.abc import Mapping
+from functools import lru_cache
+
+
+SCHEMA_VERSION = 1
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema.json')
+
+
+@lru_cache(maxsize=None)
+def load():
+    import json
+
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        schema = json.load(f)
+    if schema.get('version') != SCHEMA_VERSION:
+        raise ValueError("Unsupported API schema version %r in %s" %
+                         (schema.get('version'), SCHEMA_PATH))
+    return schema
+
+
+def resources():
+    return load()['resources']
+
+
+@lru_cache(maxsize=None)
+def field_types():
+    """
+    XML root to `{field: InSales type name}` table of the resources
+    whose fields are described. The parser uses it for elements sent
+    without a `type` attribute, the composer to type values like
+    `price=100` as the field requires.
+    """
+    return dict((resource['root'], resource['fields'])
+                for resource in resources().values()
+                if 'fields' in resource)
+
+
+class LazyArrays(Mapping):
+    "Array name to element name mapping, loaded on first lookup"
+
+    def _arrays(self):
+        return load()['arrays']
+
+    def __getitem__(self, key):
+        return self._arrays()[key]
+
+    def __iter__(self):
+        return iter(self._arrays())
+
+    def __len__(self):
+        return len(self._arrays())
+
+
+@lru_cache(maxsize=None)
+def _method_index():
+    index = {}
+    for singular, resource in resources().items():
+        names = {
+            'list': 'get_' + resource['plural'],
+            'get': 'get_' + singular,
+            'add': 'add_' + singular,
+            'update': 'update_' + singular,
+            'delete': 'delete_' + singular,
+        }
+        for action in resource['actions']:
+            index[names[action]] = (action, resource)
+    return index
+
+
+def make_method(name):
+    """
+    Build an unbound `InSalesApi` method for `name` or return None
+    if the schema has no such method. IDs are passed positionally in
+    path order, data goes last.
+    """
+    try:
+        action, resource = _method_index()[name]
+    except KeyError:
+        return None
+
+    collection = resource['collection']
+    member = resource['member']
+    root = resource['root']
+    member_ids = _id_names(member)
+    collection_ids = member_ids[:collection.count('%s')]
+
+    def path(template, id_names, ids):
+        if len(ids) != len(id_names):
+            raise TypeError("%s() takes %s, %d given" % (
+                name, _describe_ids(id_names), len(ids)))
+        return template % tuple(ids)
+
+    def split_data(args):
+        if not args:
+            raise TypeError(
+                "%s() missing required argument: 'data'" % name)
+        return args[:-1], args[-1]
+
+    if action == 'list':
+        def method(self, *ids, **qargs):
+            return self._get(path(collection, collection_ids, ids),
+                             qargs) or []
+    elif action == 'get':
+        def method(self, *ids):
+            return self._get(path(member, member_ids, ids))
+    elif action == 'add':
+        def method(self, *args):
+            ids, data = split_data(args)
+            return self._add(path(collection, collection_ids, ids), data,
+                             root=root)
+    elif action == 'update':
+        def method(self, *args):
+            ids, data = split_data(args)
+            return self._update(path(member, member_ids, ids), data,
+                                root=root)
+    else:
+        def method(self, *ids):
+            return self._delete(path(member, member_ids, ids))
+
+    method.__name__ = name
+    method.__qualname__ = 'InSalesApi.' + name
+    method.__doc__ = "%s %s (generated from API schema)" % (
+        action.capitalize(), resource['plural'] if action == 'list' else root)
+    return method
+
+
+def _id_names(path):
+    "['product_id', 'variant_id'] for /admin/products/%s/variants/%s.xml"
+    segments = path.split('/')
+    return [_singular(segments[i - 1]) + '_id'
+            for i, segment in enumerate(segments)
+            if segment.startswith('%s')]
+
+
+def _singular(plural):
+    if plural.endswith('ies'):
+        return plural[:-3] + 'y'
+    if plural.endswith('ses'):
+        return plural[:-2]
+    return plural[:-1]
+
+
+def _describe_ids(id_names):
+    if not id_names:
+        return 'no ids'
+    return 'ids (%s)' % ', '.join(id_names)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8; -*-
+
+import contextvars
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# Request priorities, lower is more urgent. BULK requests additionally
+# respect the reserve a connection keeps for the others, see
+# `Connection(reserve=...)`
+INTERACTIVE = 0
+NORMAL = 1
+BULK = 2
+
+_current_priority = contextvars.ContextVar('insales_priority', default=NORMAL)
+
+
+@contextmanager
+def priority(level):
+    """
+    Send requests made within the block with the given priority:
+
+    >>> with priority(INTERACTIVE):
+    ...     order = api.get_order(order_id)
+    """
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+class _Waiter(object):
+    __slots__ = ('priority', 'seq', 'wake')
+
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.seq = seq
+        self.wake = threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestScheduler(object):
+    """
+    Throttle state of a single account: when the last request was
+    sent and the moment before which no new request should start.
+
+    Threads that have to wait line up in a queue ordered by priority,
+    then by arrival, and are let through one at a time, so a lifted
+    back-off doesn't wake them all at once. The thread at the head of
+    the queue steps back if a more urgent request arrives while it
+    waits. A request that doesn't need to wait takes the lock once.
+    All times are `time.monotonic()` values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._holder = None
+        self._waiters = []
+        self._seq = itertools.count()
+        self.last_req_time = time.monotonic()
+        self.retry_after = self.last_req_time
+        self.bulk_retry_after = self.last_req_time
+        # (current, limit) from the last API-Usage-Limit header seen
+        self.usage = None
+
+    def acquire(self, priority=None):
+        "Block until a request may be sent and mark it as sent"
+        if priority is None:
+            priority = current_priority()
+
+        with self._lock:
+            now = time.monotonic()
+            if self._holder is None and self._deadline(priority) <= now:
+                self.last_req_time = now
+                return
+            waiter = _Waiter(priority, next(self._seq))
+            if self._holder is None:
+                self._holder = waiter
+                waiter.wake.set()
+            else:
+                heapq.heappush(self._waiters, waiter)
+                if waiter < self._holder:
+                    self._holder.wake.set()
+
+        timeout = None
+        while True:
+            waiter.wake.wait(timeout)
+            with self._lock:
+                waiter.wake.clear()
+                timeout = None
+                if self._holder is not waiter:
+                    continue
+                now = time.monotonic()
+                if self._deadline(priority) <= now:
+                    self.last_req_time = now
+                    self._promote()
+                    return
+                if self._waiters and self._waiters[0] < waiter:
+                    heapq.heappush(self._waiters, waiter)
+                    self._promote()
+                    continue
+                timeout = self._deadline(priority) - now
+
+    def _deadline(self, priority):
+        if priority >= BULK:
+            return max(self.retry_after, self.bulk_retry_after)
+        return self.retry_after
+
+    def _promote(self):
+        if self._waiters:
+            self._holder = heapq.heappop(self._waiters)
+            self._holder.wake.set()
+        else:
+            self._holder = None
+
+    def _changed(self):
+        # let the head of the queue recheck its deadline
+        if self._holder is not None:
+            self._holder.wake.set()
+
+    def set_retry_after(self, delay):
+        with self._lock:
+            self.retry_after = self.last_req_time + delay
+            self._changed()
+
+    def increase_retry_after(self, delay):
+        with self._lock:
+            self.retry_after = max(self.last_req_time, self.retry_after) + delay
+            self._changed()
+
+    def increase_bulk_retry_after(self, delay):
+        with self._lock:
+            self.bulk_retry_after = max(
+                self.last_req_time, self.bulk_retry_after) + delay
+            self._changed()
+
+    def get_retry_after(self):
+        "Retry-after moment as a wall-clock datetime"
+        with self._lock:
+            delay = self.retry_after - time.monotonic()
+        return datetime.datetime.now() + datetime.timedelta(seconds=delay)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def scheduler_for(account, api_key):
+    "Scheduler shared by all connections to the same account"
+    with _schedulers_lock:
+        key = (account, api_key)
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = RequestScheduler()
+        return scheduler